@@ -1,9 +1,14 @@
-import time
+import os
+import re
+import glob
+import random
+import asyncio
 import pytz
 import pyodbc
-import requests
-from datetime import datetime
-from bs4 import BeautifulSoup
+import aiohttp
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, timedelta
 
 # Connection string with your DB details (replace with your connection information)
 conn_str = (
@@ -14,72 +19,222 @@ conn_str = (
     "PWD=your_password;"
 )
 
+INSERT_SQL = """
+    INSERT INTO StockPrices (
+        Timestamp, INFY, ADANIGREEN, RELIANCE, TCS, HDFCBANK,
+        SBIN, ITC, HINDUNILVR, BAJAJ_AUTO, MARUTI
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+BATCH_SIZE = 30  # max ticks buffered per executemany round-trip
+FLUSH_INTERVAL = 10  # seconds; flush at least this often so the dashboard stays current
+
 tickers = [ 'INFY', 'ADANIGREEN', 'RELIANCE', 'TCS', 'HDFCBANK',
             'SBIN', 'ITC', 'HINDUNILVR', 'BAJAJ-AUTO', 'MARUTI' ]
 
+# StockPrices column names (SQL identifiers can't contain '-')
+columns = [t.replace('-', '_') for t in tickers]
+
+HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+# Matches the quote price span on the raw page bytes, e.g. <div class="YMlKec fxKbKc">₹1,523.40</div>
+PRICE_RE = re.compile(rb'class="YMlKec fxKbKc"[^>]*>\s*(?:\xe2\x82\xb9)?\s*([\d,.]+)')
+
+TICK_INTERVAL = 2  # seconds between scrapes
+REQUEST_TIMEOUT = 3  # seconds per HTTP request
+MAX_RETRIES = 1  # extra attempts per ticker before recording None
+BACKOFF_BASE = 0.25  # seconds, doubled per retry plus random jitter
+
+# Rows older than ARCHIVE_AGE are copied from StockPrices into Parquet files.
+# Each file holds the rows with start < Timestamp <= end and is named
+# prices_<start>_<end>.parquet (start is 'begin' for the first one). Every
+# pass starts where the previous file ended, so the files chain into one
+# unbroken range that the dashboard can read instead of querying SQL.
+HISTORY_DIR = 'stock_history'
+HISTORY_TS_FORMAT = '%Y%m%dT%H%M%S'
+HISTORY_SCHEMA = pa.schema(
+    [('Timestamp', pa.timestamp('ms'))] + [(c, pa.int32()) for c in columns]
+)
+ARCHIVE_AGE = timedelta(minutes=10)
+ARCHIVE_INTERVAL = 5 * 60  # seconds between archive passes
+ARCHIVE_CHUNK = 10_000  # rows per fetchmany page and Parquet row group
+
+IST = pytz.timezone('Asia/Kolkata')
+
 def get_ist_time():
-    ist = pytz.timezone('Asia/Kolkata')
-    return datetime.now(ist)
+    return datetime.now(IST)
 
-def get_stock_price(ticker):
+async def get_stock_price(session, ticker):
+    # Prices are returned (and stored) as integer paise, e.g. ₹1,523.40 -> 152340
     url = f'https://www.google.com/finance/quote/{ticker}:NSE'
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    response = requests.get(url, headers=headers)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    price_tag = soup.find(class_='YMlKec fxKbKc')
-    if price_tag:
-        price = price_tag.text.replace('₹', '').replace(',', '').strip()
+    for attempt in range(MAX_RETRIES + 1):
         try:
-            return float(price)
-        except:
-            return None
-    return None
+            async with session.get(url, headers=HEADERS) as response:
+                response.raise_for_status()
+                content = await response.read()
+            break
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == MAX_RETRIES:
+                return None
+            await asyncio.sleep(BACKOFF_BASE * 2 ** attempt + random.uniform(0, BACKOFF_BASE))
+    m = PRICE_RE.search(content)
+    if not m:
+        return None
+    try:
+        return int(round(float(m.group(1).replace(b',', b'')) * 100))
+    except ValueError:
+        return None
 
 conn = pyodbc.connect(conn_str)
 cursor = conn.cursor()
+cursor.fast_executemany = True
 
 cursor.execute("""
 IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='StockPrices' and xtype='U')
 CREATE TABLE StockPrices (
-    Timestamp DATETIME,
-    INFY FLOAT,
-    ADANIGREEN FLOAT,
-    RELIANCE FLOAT,
-    TCS FLOAT,
-    HDFCBANK FLOAT,
-    SBIN FLOAT,
-    ITC FLOAT,
-    HINDUNILVR FLOAT,
-    BAJAJ_AUTO FLOAT,
-    MARUTI FLOAT
+    Timestamp DATETIME NOT NULL,
+    INFY INT,
+    ADANIGREEN INT,
+    RELIANCE INT,
+    TCS INT,
+    HDFCBANK INT,
+    SBIN INT,
+    ITC INT,
+    HINDUNILVR INT,
+    BAJAJ_AUTO INT,
+    MARUTI INT,
+    CONSTRAINT PK_StockPrices PRIMARY KEY CLUSTERED (Timestamp)
 )
 """)
 conn.commit()
 
-start_time = time.time()
+# Prices are written as integer paise, so refuse tables that still have the
+# older FLOAT (rupee) columns rather than mixing both units in one table.
+cursor.execute("""
+SELECT COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS
+WHERE TABLE_NAME = 'StockPrices' AND COLUMN_NAME <> 'Timestamp'
+""")
+non_int = {name: dtype for name, dtype in cursor.fetchall() if dtype != 'int'}
+if non_int:
+    conn.close()
+    raise RuntimeError(
+        f"StockPrices has non-INT price columns {non_int}: it was created before prices "
+        "were stored in paise. Multiply the existing prices by 100 and ALTER the columns "
+        "to INT, or drop the table, before running the scraper."
+    )
+
 duration = 60 * 60  # 1 hour
 
-print("Starting stock data collection...")
+batch = []
+
+def archived_until():
+    ends = [
+        os.path.basename(f)[:-len('.parquet')].split('_')[2]
+        for f in glob.glob(os.path.join(HISTORY_DIR, 'prices_*_*.parquet'))
+    ]
+    return max(datetime.strptime(e, HISTORY_TS_FORMAT) for e in ends) if ends else None
+
+def archive_history():
+    start = archived_until()
+    # DATETIME holds naive IST
+    end = (get_ist_time() - ARCHIVE_AGE).replace(tzinfo=None, microsecond=0)
+    if start is not None and end <= start:
+        return
+
+    select = f"SELECT Timestamp, {', '.join(columns)} FROM StockPrices"
+    # Own cursor, so a failed pass leaves no pending results on the insert cursor
+    archive_cursor = conn.cursor()
+    if start is None:
+        archive_cursor.execute(f"{select} WHERE Timestamp <= ? ORDER BY Timestamp", end)
+    else:
+        archive_cursor.execute(f"{select} WHERE Timestamp > ? AND Timestamp <= ? ORDER BY Timestamp", start, end)
+
+    start_name = 'begin' if start is None else f"{start:{HISTORY_TS_FORMAT}}"
+    path = os.path.join(HISTORY_DIR, f"prices_{start_name}_{end:{HISTORY_TS_FORMAT}}.parquet")
+    # Written under a temporary name so readers never see a file without its footer
+    partial = path + '.partial'
+    archived = 0
+    try:
+        with pq.ParquetWriter(partial, HISTORY_SCHEMA) as writer:
+            while rows := archive_cursor.fetchmany(ARCHIVE_CHUNK):
+                cols = list(zip(*rows))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(c, type=f.type) for c, f in zip(cols, HISTORY_SCHEMA)],
+                    schema=HISTORY_SCHEMA,
+                ))
+                archived += len(rows)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        archive_cursor.close()
+
+    os.replace(partial, path)
+    print(f"Archived {archived} rows up to {end:%H:%M:%S}")
+
+def try_archive_history():
+    # The archive is only a read cache for the dashboard; never stop collecting over it
+    try:
+        archive_history()
+    except Exception as e:
+        print(f"Archiving failed, retrying next pass: {e}")
+
+def flush_batch():
+    if batch:
+        cursor.executemany(INSERT_SQL, batch)
+        conn.commit()
+        print(f"Inserted {len(batch)} rows")
+        batch.clear()
+
+async def main():
+    print("Starting stock data collection...")
+
+    loop = asyncio.get_running_loop()
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=len(tickers))
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        end_time = loop.time() + duration
+        next_tick = loop.time()
+        last_flush = loop.time()
+        last_archive = loop.time()
+
+        while loop.time() < end_time:
+            # Whole seconds; ticks are TICK_INTERVAL apart, so the PK stays unique
+            now = get_ist_time().replace(microsecond=0)
+            stock_data = [now]
+
+            prices = await asyncio.gather(*[get_stock_price(session, t) for t in tickers])
+
+            for t, p in zip(tickers, prices):
+                stock_data.append(p)
+                print(f"{t}: {p / 100 if p is not None else None}")
 
-while time.time() - start_time < duration:
-    now = get_ist_time()
-    stock_data = [now]
+            batch.append(tuple(stock_data))
+            print(f"Collected at {now.strftime('%H:%M:%S')}")
+            if len(batch) >= BATCH_SIZE or loop.time() - last_flush >= FLUSH_INTERVAL:
+                flush_batch()
+                last_flush = loop.time()
+            if loop.time() - last_archive >= ARCHIVE_INTERVAL:
+                try_archive_history()
+                last_archive = loop.time()
 
-    for t in tickers:
-        p = get_stock_price(t)
-        stock_data.append(p)
-        print(f"{t}: {p}")
+            # Schedule against a fixed grid so slow ticks don't accumulate drift
+            next_tick = max(next_tick + TICK_INTERVAL, loop.time())
+            await asyncio.sleep(next_tick - loop.time())
 
-    cursor.execute("""
-        INSERT INTO StockPrices (
-            Timestamp, INFY, ADANIGREEN, RELIANCE, TCS, HDFCBANK,
-            SBIN, ITC, HINDUNILVR, BAJAJ_AUTO, MARUTI
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, *stock_data)
+    flush_batch()
+    print("Data collection complete.")
 
-    conn.commit()
-    print(f"Inserted at {now.strftime('%H:%M:%S')}")
-    time.sleep(2)
+os.makedirs(HISTORY_DIR, exist_ok=True)
 
-print("Data collection complete.")
-conn.close()
+try:
+    try_archive_history()
+    asyncio.run(main())
+finally:
+    # Keep the ticks still buffered when the run is interrupted or fails
+    try:
+        flush_batch()
+    finally:
+        conn.close()
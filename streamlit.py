@@ -2,13 +2,17 @@
 Streamlit app for real-time stock monitoring with alert notifications.
 
 Features:
-- Fetches stock price data from Azure SQL DB.
+- Loads archived stock prices from Parquet and live ones from Azure SQL DB.
 - Displays interactive trend charts.
 - Sends email alerts when a selected stock crosses a threshold.
 """
 
+import os
+import glob
+import threading
 import streamlit as st
 import pandas as pd
+import numpy as np
 import pyodbc
 import altair as alt
 import smtplib
@@ -23,6 +27,38 @@ from config import (
     EMAIL_PASSWORD,
 )
 
+# Derived frames share memory with `df` until written to, so no defensive copies are needed
+pd.set_option("mode.copy_on_write", True)
+
+# Columns read by the dashboard, in StockPrices table order
+STOCK_COLUMNS = [
+    "INFY", "ADANIGREEN", "RELIANCE", "TCS", "HDFCBANK",
+    "SBIN", "ITC", "HINDUNILVR", "BAJAJ_AUTO", "MARUTI",
+]
+SELECT_COLUMNS = ", ".join(["Timestamp"] + STOCK_COLUMNS)
+
+# Older rows archived by the scraper as prices_<start>_<end>.parquet (see scraper.py)
+HISTORY_DIR = "stock_history"
+HISTORY_TS_FORMAT = "%Y%m%dT%H%M%S"
+
+
+@st.cache_resource
+def get_smtp() -> smtplib.SMTP_SSL:
+    """
+    Opens and logs in to the SMTP server once, reusing it for later alerts.
+    """
+    server = smtplib.SMTP_SSL("smtp.gmail.com", 465)
+    server.login(EMAIL_SENDER, EMAIL_PASSWORD)
+    return server
+
+
+@st.cache_resource
+def get_smtp_lock() -> threading.Lock:
+    """
+    Serializes use of the shared SMTP connection across session threads.
+    """
+    return threading.Lock()
+
 
 def send_email(stock: str, price: float, threshold: float, receiver_email: str):
     """
@@ -39,17 +75,27 @@ def send_email(stock: str, price: float, threshold: float, receiver_email: str):
     msg["To"] = receiver_email
 
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
+        with get_smtp_lock():
+            server = get_smtp()
+            try:
+                server.noop()
+            except (smtplib.SMTPException, OSError):
+                # Connection was dropped by the server; close it and log in again.
+                try:
+                    server.close()
+                except OSError:
+                    pass
+                get_smtp.clear()
+                server = get_smtp()
             server.send_message(msg)
     except Exception as e:
         st.error(f"❌ Failed to send email: {e}")
 
 
-@st.cache_data(ttl=5)
-def fetch_data() -> pd.DataFrame:
+@st.cache_resource
+def get_connection() -> pyodbc.Connection:
     """
-    Fetches the stock data from the Azure SQL Database.
+    Opens the Azure SQL Database connection once and shares it across reruns.
     """
     conn_str = (
         f"DRIVER={{ODBC Driver 18 for SQL Server}};"
@@ -58,16 +104,193 @@ def fetch_data() -> pd.DataFrame:
         f"UID={DB_USER};"
         f"PWD={DB_PASSWORD};"
     )
+    return pyodbc.connect(conn_str, autocommit=True)
+
+
+@st.cache_resource
+def get_connection_lock() -> threading.Lock:
+    """
+    Serializes use of the shared database connection across session threads.
+    """
+    return threading.Lock()
+
+
+@st.cache_data(ttl=60)
+def get_price_divisor(_conn: pyodbc.Connection) -> int:
+    """
+    Returns what stored prices are divided by to get rupees: 100 for the INT
+    (paise) columns, 1 for tables created with the older FLOAT (rupee) columns.
+
+    The TTL lets a running dashboard notice when an old table is migrated to INT.
+    """
+    cursor = _conn.cursor()
+    cursor.execute(
+        "SELECT DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS "
+        "WHERE TABLE_NAME = 'StockPrices' AND COLUMN_NAME <> 'Timestamp'"
+    )
+    types = {row.DATA_TYPE for row in cursor.fetchall()}
+    if types == {"int"}:
+        return 100
+    if types and types <= {"float", "real"}:
+        return 1
+    raise ValueError(f"Unexpected StockPrices price column types: {sorted(types)}")
+
+
+def get_new_rows(conn: pyodbc.Connection, since_ts) -> pd.DataFrame:
+    """
+    Fetches the rows newer than `since_ts`, or the whole table when nothing is cached yet.
+    """
+    if since_ts is None:
+        rows = pd.read_sql(f"SELECT {SELECT_COLUMNS} FROM StockPrices ORDER BY Timestamp", conn)
+    else:
+        rows = pd.read_sql(
+            f"SELECT {SELECT_COLUMNS} FROM StockPrices WHERE Timestamp > ? ORDER BY Timestamp",
+            conn,
+            params=[since_ts.to_pydatetime()],
+        )
+    return prepare_rows(rows, get_price_divisor(conn))
+
+
+def prepare_rows(rows: pd.DataFrame, divisor: int) -> pd.DataFrame:
+    """
+    Normalizes dtypes, converts prices to rupees and adds the display time.
+    """
+    rows["Timestamp"] = pd.to_datetime(rows["Timestamp"])
+    # NULLs make pandas read integer price columns as float, so cast before scaling
+    rows[STOCK_COLUMNS] = rows[STOCK_COLUMNS].astype("float32") / divisor
+    rows["Formatted_Time"] = rows["Timestamp"].dt.strftime("%d-%m-%Y %H:%M")
+    return rows
+
+
+def read_archive(path: str) -> pd.DataFrame:
+    """
+    Reads one archive file; the scraper always stores its prices as int32 paise.
+    """
+    return prepare_rows(pd.read_parquet(path, columns=["Timestamp"] + STOCK_COLUMNS), 100)
+
+
+def load_history() -> tuple:
+    """
+    Loads the archived rows, oldest first, and the end of the range they cover.
+
+    Only the unbroken chain of ranges starting at the first file is used, so a
+    missing file never hides rows: everything after the chain is read from SQL.
+    """
+    ranges = {}
+    for path in glob.glob(os.path.join(HISTORY_DIR, "prices_*_*.parquet")):
+        _, start, end = os.path.basename(path)[: -len(".parquet")].split("_")
+        ranges[start] = (end, path)
+
+    files, until, key = [], None, "begin"
+    while key in ranges:
+        until, path = ranges.pop(key)
+        files.append(path)
+        key = until
+    if not files:
+        return pd.DataFrame(), None
 
     try:
-        conn = pyodbc.connect(conn_str)
-        df = pd.read_sql("SELECT * FROM StockPrices ORDER BY Timestamp DESC", conn)
-        conn.close()
-        df["Timestamp"] = pd.to_datetime(df["Timestamp"])
-        return df
+        history = pd.concat([read_archive(f) for f in files], ignore_index=True)
     except Exception as e:
+        st.warning(f"⚠️ Could not read price history, loading from database: {e}")
+        return pd.DataFrame(), None
+
+    history = history.sort_values("Timestamp", ignore_index=True)
+    return history, pd.Timestamp(pd.to_datetime(until, format=HISTORY_TS_FORMAT))
+
+
+def fetch_data() -> pd.DataFrame:
+    """
+    Fetches the stock data from the Parquet history and the Azure SQL Database.
+
+    The first run of a session loads the archived history and only asks SQL for
+    rows after the archived range. Rows already seen are kept in `st.session_state.df_cache`,
+    so each refresh only transfers (and formats) the rows inserted since the last one.
+    The result is in ascending Timestamp order, since new rows are always newer.
+    """
+    if "df_cache" not in st.session_state:
+        st.session_state.df_cache, st.session_state.last_ts = load_history()
+
+    cache = st.session_state.df_cache
+
+    try:
+        with get_connection_lock():
+            conn = get_connection()
+            try:
+                new_rows = get_new_rows(conn, st.session_state.last_ts)
+            except pyodbc.Error:
+                # The cached connection may have been dropped; close it and reconnect once.
+                try:
+                    conn.close()
+                except pyodbc.Error:
+                    pass
+                get_connection.clear()
+                get_price_divisor.clear()
+                new_rows = get_new_rows(get_connection(), st.session_state.last_ts)
+    except (pyodbc.Error, ValueError) as e:
         st.error(f"❌ Error fetching data: {e}")
-        return pd.DataFrame()
+        return cache
+
+    if new_rows.empty:
+        return cache
+
+    df = new_rows if cache.empty else pd.concat([cache, new_rows], ignore_index=True)
+    st.session_state.df_cache = df
+    st.session_state.last_ts = df["Timestamp"].max()
+    return df
+
+
+@st.cache_data(max_entries=50)
+def build_trend_chart(_plot_df: pd.DataFrame, stock: str, last_ts, n_rows: int, y_domain: tuple) -> dict:
+    """
+    Builds the Vega-Lite spec for the trend chart.
+
+    Only `stock`, `last_ts`, `n_rows` and `y_domain` are hashed (the leading
+    underscore keeps Streamlit from hashing the frame), so refreshes without
+    new readings reuse the cached spec instead of re-encoding it.
+    """
+    return alt.Chart(_plot_df).mark_line(point=True).encode(
+        x=alt.X("Reading:O", title="Reading #"),
+        y=alt.Y(f"{stock}:Q", title="Price", scale=alt.Scale(domain=list(y_domain))),
+        tooltip=[
+            alt.Tooltip("Formatted_Time:N", title="Date & Time"),
+            alt.Tooltip(f"{stock}:Q", title="Price", format=".2f")
+        ]
+    ).properties(width=800, height=400).interactive().to_dict()
+
+
+@st.cache_data(max_entries=50)
+def build_compare_chart(_wide_df: pd.DataFrame, stocks: tuple, last_ts) -> dict:
+    """
+    Builds the Vega-Lite spec comparing `stocks`, cached on the latest timestamp.
+    """
+    compare_df = (
+        _wide_df.set_index("Timestamp")
+        .stack()
+        .rename_axis(["Timestamp", "Stock"])
+        .reset_index(name="Price")
+        .astype({"Stock": "category", "Price": "float32"})
+    )
+    return alt.Chart(compare_df).mark_line().encode(
+        x="Timestamp:T",
+        y="Price:Q",
+        color="Stock:N",
+        tooltip=["Stock:N", alt.Tooltip("Price:Q", format=".2f"), alt.Tooltip("Timestamp:T", title="Date & Time")]
+    ).properties(width=900, height=400).interactive().to_dict()
+
+
+def top_k_indices(values: np.ndarray, k: int = 5, largest: bool = True) -> np.ndarray:
+    """
+    Returns the positions of the `k` largest (or smallest) values, best first.
+
+    `np.argpartition` selects them in O(n); only the `k` picks get sorted.
+    """
+    k = min(k, len(values))
+    if k == 0:
+        return np.array([], dtype=np.intp)
+    keyed = -values if largest else values
+    idx = np.argpartition(keyed, k - 1)[:k]
+    return idx[np.argsort(keyed[idx])]
 
 
 def init_session_state():
@@ -95,8 +318,8 @@ if df.empty:
     st.warning("No stock data available.")
     st.stop()
 
-df = df.sort_values(by="Timestamp")
-stock_list = [col for col in df.columns if col not in ["Timestamp", "id"]]
+stock_list = [col for col in df.columns if col not in ["Timestamp", "Formatted_Time", "id"]]
+col_idx = {c: i for i, c in enumerate(df.columns)}
 
 init_session_state()
 
@@ -106,12 +329,21 @@ st.sidebar.header("🔔 Set Threshold Alert")
 selected_stock = st.sidebar.selectbox(
     "Select stock for alert:", stock_list, index=stock_list.index(st.session_state.alert_stock)
 )
-threshold = st.sidebar.number_input("Price threshold:", value=st.session_state.threshold)
-email_receiver = st.sidebar.text_input("Alert email to:", value=st.session_state.email)
+# Widgets are keyed per stock, so switching stocks shows that stock's saved alert
+saved_alert = st.session_state.prev_config.get(selected_stock, {})
+threshold = st.sidebar.number_input(
+    "Price threshold:",
+    value=saved_alert.get("threshold", st.session_state.threshold),
+    key=f"threshold_{selected_stock}",
+)
+email_receiver = st.sidebar.text_input(
+    "Alert email to:",
+    value=saved_alert.get("email", st.session_state.email),
+    key=f"email_{selected_stock}",
+)
 
-# --- Reset alert if config changed ---
-prev_config = st.session_state.prev_config.get(selected_stock, {})
-if prev_config.get("threshold") != threshold or prev_config.get("email") != email_receiver:
+# --- Enable (or update) the alert for the selected stock ---
+if st.sidebar.button("Update alert" if saved_alert else "Enable alert"):
     st.session_state.alert_sent[selected_stock] = False
     st.session_state.prev_config[selected_stock] = {
         "threshold": threshold,
@@ -123,63 +355,84 @@ st.session_state.alert_stock = selected_stock
 st.session_state.threshold = threshold
 st.session_state.email = email_receiver
 
-# --- Alert Logic ---
-latest_price = df.iloc[-1][selected_stock]
+# --- Active Alerts ---
+if st.session_state.prev_config:
+    st.sidebar.caption("Active alerts:")
+    for s, cfg in list(st.session_state.prev_config.items()):
+        name_col, remove_col = st.sidebar.columns([4, 1])
+        name_col.write(f"{s} > ₹{cfg['threshold']}")
+        if remove_col.button("✖", key=f"remove_alert_{s}", help=f"Stop alerts for {s}"):
+            del st.session_state.prev_config[s]
+            st.session_state.alert_sent.pop(s, None)
+            st.rerun()
 
-if latest_price > threshold:
-    if not st.session_state.alert_sent.get(selected_stock, False):
-        send_email(selected_stock, latest_price, threshold, email_receiver)
-        st.session_state.alert_sent[selected_stock] = True
-        st.sidebar.error(f"🚨 Alert sent: {selected_stock} = ₹{latest_price} > ₹{threshold}")
-    else:
-        st.sidebar.warning("📨 Alert already sent.")
+# --- Alert Logic ---
+# Every enabled alert is checked at once, whichever stock the sidebar shows.
+alert_stocks = [s for s in st.session_state.prev_config if s in col_idx]
+thresholds_np = np.array([st.session_state.prev_config[s]["threshold"] for s in alert_stocks], dtype=float)
+alert_sent_mask = np.array([st.session_state.alert_sent.get(s, False) for s in alert_stocks], dtype=bool)
+latest_row_np = df[alert_stocks].iloc[-1].to_numpy(dtype=float)
+
+breached = latest_row_np > thresholds_np
+for i in np.nonzero(breached & ~alert_sent_mask)[0]:
+    s = alert_stocks[i]
+    send_email(s, round(latest_row_np[i], 2), thresholds_np[i], st.session_state.prev_config[s]["email"])
+    st.session_state.alert_sent[s] = True
+for i in np.nonzero(~breached)[0]:
+    st.session_state.alert_sent[alert_stocks[i]] = False
+
+latest_price = df.iat[-1, col_idx[selected_stock]]
+if selected_stock not in alert_stocks:
+    st.sidebar.info(f"ℹ️ No alert enabled for {selected_stock} (₹{latest_price})")
 else:
-    st.sidebar.success(f"✅ {selected_stock} is ₹{latest_price} (below threshold)")
-    st.session_state.alert_sent[selected_stock] = False
+    sel = alert_stocks.index(selected_stock)
+    if breached[sel]:
+        if not alert_sent_mask[sel]:
+            st.sidebar.error(f"🚨 Alert sent: {selected_stock} = ₹{latest_price} > ₹{thresholds_np[sel]}")
+        else:
+            st.sidebar.warning("📨 Alert already sent.")
+    else:
+        st.sidebar.success(f"✅ {selected_stock} is ₹{latest_price} (below threshold)")
+
+# --- Sidebar for Chart Settings ---
+st.sidebar.header("📈 Chart Settings")
+trend_window = st.sidebar.slider(
+    "Readings shown in trend chart:", min_value=50, max_value=5000, value=500, step=50
+)
 
 # --- Section: Trend Monitor ---
 st.subheader("🔍 Stock Price Monitor")
 stock = st.selectbox("Choose a stock to view trend:", stock_list)
 
-df_selected = df[["Timestamp", stock]].dropna().copy()
-df_selected.reset_index(drop=True, inplace=True)
-df_selected["Reading"] = df_selected.index + 1
-df_selected["Formatted_Time"] = df_selected["Timestamp"].dt.strftime("%d-%m-%Y %H:%M")
+df_selected = df[["Timestamp", "Formatted_Time", stock]].dropna().reset_index(drop=True)
+df_selected["Reading"] = np.arange(1, len(df_selected) + 1, dtype=np.int32)
 
-latest_price = df_selected[stock].iloc[-1]
-latest_time = df_selected["Formatted_Time"].iloc[-1]
-st.metric(label=f"📌 Latest {stock} Price", value=latest_price)
+plot_df = df_selected.tail(trend_window)
+arr = plot_df[stock].to_numpy(np.float32, copy=False)
+min_price, max_price, latest_price = arr.min(), arr.max(), arr[-1]
+
+latest_time = df_selected["Formatted_Time"].iat[-1]
+st.metric(label=f"📌 Latest {stock} Price", value=round(float(latest_price), 2))
 st.caption(f"Last updated: {latest_time}")
 
-min_price = df_selected[stock].min()
-max_price = df_selected[stock].max()
 padding = (max_price - min_price) * 0.02 if max_price > min_price else 1
-y_scale = alt.Scale(domain=[min_price - padding, max_price + padding])
-
-trend_chart = alt.Chart(df_selected).mark_line(point=True).encode(
-    x=alt.X("Reading:O", title="Reading #"),
-    y=alt.Y(f"{stock}:Q", title="Price", scale=y_scale),
-    tooltip=[
-        alt.Tooltip("Formatted_Time:N", title="Date & Time"),
-        alt.Tooltip(f"{stock}:Q", title="Price")
-    ]
-).properties(width=800, height=400).interactive()
+y_domain = (float(min_price - padding), float(max_price + padding))
 
-st.altair_chart(trend_chart, use_container_width=True)
+trend_spec = build_trend_chart(
+    plot_df, stock, plot_df["Timestamp"].iat[-1], len(plot_df), y_domain
+)
+st.vega_lite_chart(trend_spec, use_container_width=True)
 
 # --- Section: Gainers & Losers ---
 st.subheader("📈 Top Gainers & 📉 Losers")
-recent_df = df.tail(5).copy()
-price_change = {}
-for s in stock_list:
-    if recent_df[s].notnull().sum() >= 2:
-        first, last = recent_df[s].iloc[0], recent_df[s].iloc[-1]
-        change = ((last - first) / first) * 100 if first != 0 else 0
-        price_change[s] = round(change, 2)
-
-change_df = pd.DataFrame(price_change.items(), columns=["Stock", "Change(%)"])
-gainers = change_df.sort_values(by="Change(%)", ascending=False).head(5)
-losers = change_df.sort_values(by="Change(%)").head(5)
+recent = df[stock_list].tail(5).to_numpy()
+first, last = recent[0], recent[-1]
+pct = (last - first) / np.where(first == 0, np.nan, first) * 100
+
+change_df = pd.DataFrame({"Stock": stock_list, "Change(%)": pct.round(2)}).dropna()
+change_arr = change_df["Change(%)"].to_numpy()
+gainers = change_df.iloc[top_k_indices(change_arr)]
+losers = change_df.iloc[top_k_indices(change_arr, largest=False)]
 
 col1, col2 = st.columns(2)
 with col1:
@@ -191,28 +444,28 @@ with col2:
 
 # --- Section: Price Snapshot ---
 st.subheader("💰 Stock Price Snapshot")
-latest_row = df.iloc[-1][stock_list]
-top_prices = latest_row.sort_values(ascending=False).head(5)
-bottom_prices = latest_row.sort_values().head(5)
+last_row_arr = df[stock_list].iloc[-1].to_numpy()
+stock_names = np.array(stock_list)
+idx_top = top_k_indices(last_row_arr)
+idx_bottom = top_k_indices(last_row_arr, largest=False)
+top_prices = pd.DataFrame({"Stock": stock_names[idx_top], "Price": last_row_arr[idx_top]})
+bottom_prices = pd.DataFrame({"Stock": stock_names[idx_bottom], "Price": last_row_arr[idx_bottom]})
 
 col3, col4 = st.columns(2)
 with col3:
     st.success("Most Expensive Stocks Now")
-    st.dataframe(top_prices.reset_index().rename(columns={"index": "Stock", latest_row.name: "Price"}))
+    st.dataframe(top_prices)
 with col4:
     st.warning("Least Expensive Stocks Now")
-    st.dataframe(bottom_prices.reset_index().rename(columns={"index": "Stock", latest_row.name: "Price"}))
+    st.dataframe(bottom_prices)
 
 # --- Section: Compare Multiple Stocks ---
 st.subheader("📊 Compare Multiple Stocks")
 selected_stocks = st.multiselect("Select stocks to compare:", stock_list, default=stock_list[:3])
 if selected_stocks:
     compare_df = df[["Timestamp"] + selected_stocks].dropna().tail(20)
-    compare_df = pd.melt(compare_df, id_vars=["Timestamp"], var_name="Stock", value_name="Price")
-    chart = alt.Chart(compare_df).mark_line().encode(
-        x="Timestamp:T",
-        y="Price:Q",
-        color="Stock:N",
-        tooltip=["Stock:N", "Price:Q", alt.Tooltip("Timestamp:T", title="Date & Time")]
-    ).properties(width=900, height=400).interactive()
-    st.altair_chart(chart, use_container_width=True)
+    if not compare_df.empty:
+        compare_spec = build_compare_chart(
+            compare_df, tuple(selected_stocks), compare_df["Timestamp"].iat[-1]
+        )
+        st.vega_lite_chart(compare_spec, use_container_width=True)